@@ -5,9 +5,6 @@ from .router import api_router
 from .database import engine
 from . import model
 
-# Crear tablas (opcional si usas migraciones)
-model.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="Sistema de Control de Acceso Facial",
     description="API para control de acceso a laboratorios con reconocimiento facial",
@@ -21,8 +18,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Crear tablas al iniciar (opcional si usas migraciones). Se hace en el arranque
+# y no al importar para que util/ pueda usar app.engines sin conectarse a la DB
+# create_all no agrega columnas nuevas a tablas existentes: ver la sección de
+# migración al final de util/Script.sql
+@app.on_event("startup")
+def create_tables():
+    model.Base.metadata.create_all(bind=engine)
+
 # Incluir rutas
 app.include_router(api_router, prefix="/api")
 
@@ -0,0 +1,85 @@
+import struct
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+from uuid import UUID
+import numpy as np
+
+# Formato binario (little-endian) del paquete de embeddings de un laboratorio:
+#
+#   cabecera   magic "FEB1", formato, flags, dimensión, reservado,
+#              n_vectores, n_miembros, since (µs), versión (µs)
+#   ids        n_vectores x 16 bytes (UUID)
+#   vectores   n_vectores x dimensión x float32
+#   miembros   n_miembros x 16 bytes (UUID), solo en deltas: el conjunto
+#              completo de usuarios autorizados, para que el kiosco descarte
+#              los que ya no están (revocaciones, embeddings borrados)
+#
+# La versión avanza con altas, re-codificaciones y revocaciones, pero un borrado
+# en cascada (usuario eliminado) no la mueve: el kiosco debe aplicar siempre la
+# lista de miembros de un delta, aunque la versión no haya cambiado.
+BUNDLE_MAGIC = b"FEB1"
+BUNDLE_FORMAT = 2  # 2: versiones en microsegundos (antes milisegundos)
+FLAG_DELTA = 0x1
+
+HEADER = struct.Struct("<4sHHHHIIQQ")
+
+class Bundle(NamedTuple):
+    dimension: int
+    since: int
+    version: int
+    user_ids: List[UUID]
+    encodings: np.ndarray
+    members: Optional[List[UUID]]
+
+    @property
+    def is_delta(self) -> bool:
+        return self.members is not None
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+def to_version(moment: Optional[datetime]) -> int:
+    """Marca de tiempo (UTC ingenuo, como en los modelos) en microsegundos, la
+    resolución de las columnas: un delta desde esta versión compara exactamente
+    y no omite ni repite cambios"""
+    if moment is None:
+        return 0
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+def from_version(version: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=version)
+
+
+def pack_bundle(
+    dimension: int,
+    user_ids: List[UUID],
+    encodings: np.ndarray,
+    version: int,
+    since: int = 0,
+    members: Optional[List[UUID]] = None
+) -> bytes:
+    encodings = np.asarray(encodings, dtype="<f4").reshape(len(user_ids), dimension)
+    flags = FLAG_DELTA if members is not None else 0
+    members = members or []
+    return b"".join([
+        HEADER.pack(BUNDLE_MAGIC, BUNDLE_FORMAT, flags, dimension, 0,
+                    len(user_ids), len(members), since, version),
+        b"".join(user_id.bytes for user_id in user_ids),
+        encodings.tobytes(),
+        b"".join(user_id.bytes for user_id in members),
+    ])
+
+def unpack_bundle(data: bytes) -> Bundle:
+    magic, fmt, flags, dimension, _, count, member_count, since, version = HEADER.unpack_from(data)
+    if magic != BUNDLE_MAGIC or fmt != BUNDLE_FORMAT:
+        raise ValueError("Paquete de embeddings no válido")
+
+    offset = HEADER.size
+    user_ids = [UUID(bytes=data[offset + 16 * i:offset + 16 * (i + 1)]) for i in range(count)]
+    offset += 16 * count
+    encodings = np.frombuffer(data, dtype="<f4", count=count * dimension, offset=offset).reshape(count, dimension)
+    offset += 4 * count * dimension
+    members = None
+    if flags & FLAG_DELTA:
+        members = [UUID(bytes=data[offset + 16 * i:offset + 16 * (i + 1)]) for i in range(member_count)]
+    return Bundle(dimension, since, version, user_ids, encodings, members)
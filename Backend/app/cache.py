@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# Segundos que una entrada de datos de referencia (laboratorios, usuarios) se
+# considera vigente; acota el desfase entre workers
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "60"))
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+class ReferenceCache:
+    """Caché read-through con TTL para respuestas JSON de datos de referencia.
+
+    Cada clave tiene una generación que ``invalidate`` incrementa: un valor
+    cargado antes de una invalidación no se guarda (ver ``set``).
+    """
+
+    def __init__(self, ttl: float = REFERENCE_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, CacheEntry] = {}
+        self._generations: Dict[Hashable, int] = {}
+        self._epoch = 0  # Incrementado por clear()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                return None
+            return entry
+
+    def generation(self, key: Hashable) -> Tuple[int, int]:
+        """Generación actual de la clave; se toma antes de ejecutar el loader"""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[Tuple[int, int]] = None) -> CacheEntry:
+        """Guarda el valor, salvo que la clave se haya invalidado después de
+        ``generation``: en ese caso la entrada solo sirve para la respuesta actual"""
+        body = json.dumps(jsonable_encoder(value), separators=(",", ":")).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        entry = CacheEntry(body, etag, time.monotonic() + self.ttl)
+        with self._lock:
+            if generation is None or generation == (self._epoch, self._generations.get(key, 0)):
+                self._entries[key] = entry
+        return entry
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+
+reference_cache = ReferenceCache()
+
+# Claves de la caché
+ALL_LABORATORIES = ("laboratories",)
+
+def laboratory_key(lab_id) -> tuple:
+    return ("laboratory", str(lab_id))
+
+def user_key(user_id) -> tuple:
+    return ("user", str(user_id))
+
+def user_permissions_key(user_id) -> tuple:
+    return ("permissions", str(user_id))
+
+
+def cached_response(request: Request, key: Hashable, loader: Callable[[], Any]) -> Response:
+    """Responde desde la caché con ETag; si If-None-Match coincide devuelve 304.
+
+    ``loader`` solo se ejecuta (y solo entonces se consulta la base de datos)
+    cuando la entrada no está en caché o expiró.
+    """
+    entry = reference_cache.get(key)
+    if entry is None:
+        # Si una escritura invalida la clave mientras corre el loader, su
+        # resultado (posiblemente anterior a la escritura) no se guarda
+        generation = reference_cache.generation(key)
+        entry = reference_cache.set(key, loader(), generation)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or
+                          entry.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
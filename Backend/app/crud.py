@@ -1,10 +1,13 @@
 # app/crud.py
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_, or_, delete, func, update, select, literal, cast, true, DateTime, Uuid
+from sqlalchemy.dialects import postgresql, sqlite
 from . import model, schemas
+from .cache import reference_cache, ALL_LABORATORIES, laboratory_key, user_key, user_permissions_key
 from passlib.context import CryptContext
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from uuid import UUID
+from datetime import datetime
 import numpy as np
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -29,6 +32,7 @@ def create_user(db: Session, user: schemas.UserCreate) -> model.User:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    reference_cache.invalidate(user_key(db_user.id))
     return db_user
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -42,6 +46,7 @@ def update_user_facial_status(db: Session, user_id: UUID, registered: bool):
         {"facial_data_registered": registered}
     )
     db.commit()
+    reference_cache.invalidate(user_key(user_id))
 
 # Laboratory CRUD
 def create_laboratory(db: Session, lab: schemas.LaboratoryCreate) -> model.Laboratory:
@@ -49,6 +54,7 @@ def create_laboratory(db: Session, lab: schemas.LaboratoryCreate) -> model.Labor
     db.add(db_lab)
     db.commit()
     db.refresh(db_lab)
+    reference_cache.invalidate(ALL_LABORATORIES, laboratory_key(db_lab.id))
     return db_lab
 
 def get_all_laboratories(db: Session) -> List[model.Laboratory]:
@@ -62,12 +68,19 @@ def create_facial_embedding(
     db: Session,
     user_id: UUID,
     embedding: List[float],
-    image_path: str
+    image_path: str,
+    engine: str = "dlib-hog",
+    metric: str = "euclidean",
+    engine_version: Optional[str] = None
 ) -> model.FacialEmbedding:
     db_embedding = model.FacialEmbedding(
         user_id=user_id,
         embedding=embedding,
-        image_path=image_path
+        image_path=image_path,
+        engine=engine,
+        engine_version=engine_version,
+        embedding_dim=len(embedding),
+        metric=metric
     )
     db.add(db_embedding)
     db.commit()
@@ -79,8 +92,160 @@ def get_facial_embedding_by_user(db: Session, user_id: UUID) -> Optional[model.F
         model.FacialEmbedding.user_id == user_id
     ).first()
 
-def get_all_facial_embeddings(db: Session) -> List[model.FacialEmbedding]:
-    return db.query(model.FacialEmbedding).all()
+def get_lab_embedding_changes(
+    db: Session,
+    lab_id: UUID,
+    since: Optional[datetime] = None,
+    embedding_dim: Optional[int] = None,
+    metric: Optional[str] = None
+) -> List[Tuple[UUID, List[float]]]:
+    """(user_id, embedding) de los usuarios autorizados en el laboratorio cuyo
+    embedding o permiso cambió después de ``since`` (todos si es None)"""
+    query = db.query(model.FacialEmbedding.user_id, model.FacialEmbedding.embedding).join(
+        model.LabAccessPermission,
+        model.LabAccessPermission.user_id == model.FacialEmbedding.user_id
+    ).filter(
+        model.LabAccessPermission.laboratory_id == lab_id
+    )
+    if since is not None:
+        query = query.filter(or_(
+            model.FacialEmbedding.updated_at > since,
+            model.LabAccessPermission.granted_at > since
+        ))
+    return [tuple(row) for row in _filter_embedding_space(query, embedding_dim, metric).all()]
+
+def get_lab_embedding_members(
+    db: Session,
+    lab_id: UUID,
+    embedding_dim: Optional[int] = None,
+    metric: Optional[str] = None
+) -> Tuple[List[UUID], Optional[datetime]]:
+    """Usuarios autorizados con embedding en el laboratorio y la fecha del último
+    cambio, incluida la última revocación para que no retroceda al quitar miembros"""
+    query = db.query(
+        model.FacialEmbedding.user_id,
+        model.FacialEmbedding.updated_at,
+        model.LabAccessPermission.granted_at
+    ).join(
+        model.LabAccessPermission,
+        model.LabAccessPermission.user_id == model.FacialEmbedding.user_id
+    ).filter(
+        model.LabAccessPermission.laboratory_id == lab_id
+    )
+    rows = _filter_embedding_space(query, embedding_dim, metric).all()
+    changes = [moment for row in rows for moment in (row.updated_at, row.granted_at) if moment is not None]
+    revoked_at = db.query(model.Laboratory.permissions_revoked_at).filter(
+        model.Laboratory.id == lab_id
+    ).scalar()
+    if revoked_at is not None:
+        changes.append(revoked_at)
+    return [row.user_id for row in rows], max(changes, default=None)
+
+def get_stale_facial_embeddings(
+    db: Session,
+    engine_version: str,
+    after_id: Optional[UUID] = None,
+    limit: int = 100
+) -> List[Tuple[UUID, UUID, str]]:
+    """(id, user_id, image_path) de embeddings calculados con otra versión de motor,
+    en orden de id para recorrerlos por bloques (paginación por clave)"""
+    query = db.query(
+        model.FacialEmbedding.id,
+        model.FacialEmbedding.user_id,
+        model.FacialEmbedding.image_path
+    ).filter(
+        or_(model.FacialEmbedding.engine_version.is_(None),
+            model.FacialEmbedding.engine_version != engine_version),
+        model.FacialEmbedding.image_path.isnot(None)
+    )
+    if after_id is not None:
+        query = query.filter(model.FacialEmbedding.id > after_id)
+    return [tuple(row) for row in query.order_by(model.FacialEmbedding.id).limit(limit).all()]
+
+def bulk_update_facial_embeddings(db: Session, updates: List[dict]):
+    """Actualiza varios embeddings (dicts con ``id``) en un solo commit"""
+    if not updates:
+        return
+    now = datetime.utcnow()
+    for values in updates:
+        values.setdefault("updated_at", now)
+    try:
+        db.bulk_update_mappings(model.FacialEmbedding, updates)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def get_facial_embeddings_by_users(db: Session, user_ids: List[UUID]) -> List[model.FacialEmbedding]:
+    return db.query(model.FacialEmbedding).filter(
+        model.FacialEmbedding.user_id.in_(user_ids)
+    ).all()
+
+def _filter_embedding_space(query, embedding_dim: Optional[int], metric: Optional[str]):
+    """Restringe a embeddings comparables con el motor activo"""
+    if embedding_dim is not None:
+        query = query.filter(model.FacialEmbedding.embedding_dim == embedding_dim)
+    if metric is not None:
+        query = query.filter(model.FacialEmbedding.metric == metric)
+    return query
+
+def get_all_facial_embeddings(
+    db: Session,
+    embedding_dim: Optional[int] = None,
+    metric: Optional[str] = None,
+    changed_since: Optional[datetime] = None
+) -> List[model.FacialEmbedding]:
+    query = db.query(model.FacialEmbedding)
+    if changed_since is not None:
+        query = query.filter(model.FacialEmbedding.updated_at >= changed_since)
+    return _filter_embedding_space(query, embedding_dim, metric).all()
+
+def get_lab_facial_embeddings(
+    db: Session,
+    lab_id: UUID,
+    embedding_dim: Optional[int] = None,
+    metric: Optional[str] = None,
+    changed_since: Optional[datetime] = None
+) -> List[model.FacialEmbedding]:
+    """Embeddings de los usuarios con permiso de acceso al laboratorio"""
+    query = db.query(model.FacialEmbedding).join(
+        model.LabAccessPermission,
+        model.LabAccessPermission.user_id == model.FacialEmbedding.user_id
+    ).filter(
+        model.LabAccessPermission.laboratory_id == lab_id
+    )
+    if changed_since is not None:
+        query = query.filter(or_(
+            model.FacialEmbedding.updated_at >= changed_since,
+            model.LabAccessPermission.granted_at >= changed_since
+        ))
+    return _filter_embedding_space(query, embedding_dim, metric).all()
+
+def get_gallery_signature(
+    db: Session,
+    lab_id: Optional[UUID] = None,
+    embedding_dim: Optional[int] = None,
+    metric: Optional[str] = None
+) -> Tuple[int, Optional[datetime]]:
+    """(cantidad, último cambio) de los embeddings de una galería; sin lab_id, de toda
+    la población. Una sola consulta de agregación, resuelta sobre el índice
+    idx_facial_embeddings_space, para detectar galerías desactualizadas"""
+    if lab_id is None:
+        query = db.query(func.count(), func.max(model.FacialEmbedding.updated_at))
+    else:
+        query = db.query(
+            func.count(),
+            func.max(model.FacialEmbedding.updated_at),
+            func.max(model.LabAccessPermission.granted_at)
+        ).join(
+            model.LabAccessPermission,
+            model.LabAccessPermission.user_id == model.FacialEmbedding.user_id
+        ).filter(
+            model.LabAccessPermission.laboratory_id == lab_id
+        )
+    row = _filter_embedding_space(query, embedding_dim, metric).one()
+    changes = [moment for moment in row[1:] if moment is not None]
+    return row[0], max(changes, default=None)
 
 # Lab Access Permission CRUD
 def grant_lab_access(
@@ -97,8 +262,118 @@ def grant_lab_access(
     db.add(db_permission)
     db.commit()
     db.refresh(db_permission)
+    reference_cache.invalidate(user_permissions_key(user_id))
     return db_permission
 
+def _bulk_user_filters(user_ids: Optional[List[UUID]], role: Optional[str]) -> list:
+    """Condiciones sobre users de una operación masiva (lista y/o rol)"""
+    filters = []
+    if user_ids is not None:
+        filters.append(model.User.id.in_(user_ids))
+    if role is not None:
+        filters.append(model.User.role == role)
+    return filters
+
+def count_users(
+    db: Session,
+    user_ids: Optional[List[UUID]] = None,
+    role: Optional[str] = None
+) -> int:
+    """Cantidad de usuarios existentes filtrados por lista y/o rol"""
+    return db.query(func.count()).select_from(model.User).filter(*_bulk_user_filters(user_ids, role)).scalar()
+
+def get_laboratory_ids(db: Session, lab_ids: List[UUID]) -> List[UUID]:
+    return [row.id for row in db.query(model.Laboratory.id).filter(model.Laboratory.id.in_(lab_ids)).all()]
+
+def _sql_value(db: Session, value, type_):
+    """Parámetro para la lista de un SELECT: Postgres necesita el CAST para
+    insertarlo en una columna uuid/timestamp (SQLite no, y CAST lo convertiría)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(literal(value, type_), type_)
+    return literal(value, type_)
+
+def _sql_new_uuid(db: Session):
+    """UUID generado por la base de datos (INSERT ... SELECT no pasa por el default de Python)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.gen_random_uuid()
+    return func.lower(func.hex(func.randomblob(16)))  # Uuid se guarda como 32 hex en SQLite
+
+def bulk_grant_lab_access(
+    db: Session,
+    lab_ids: List[UUID],
+    user_ids: Optional[List[UUID]] = None,
+    role: Optional[str] = None,
+    granted_by: Optional[UUID] = None
+) -> Tuple[int, int]:
+    """Otorga todos los pares usuario-laboratorio en un solo INSERT ... SELECT.
+
+    Los usuarios (por lista y/o rol) se cruzan con los laboratorios dentro de la
+    base de datos y los pares existentes se omiten con ON CONFLICT DO NOTHING
+    sobre UNIQUE(user_id, laboratory_id). Devuelve (creados, omitidos).
+    """
+    if not lab_ids or user_ids == []:
+        return 0, 0
+
+    pairs = select(
+        _sql_new_uuid(db),
+        model.User.id,
+        model.Laboratory.id,
+        _sql_value(db, datetime.utcnow(), DateTime()),
+        _sql_value(db, granted_by, Uuid())
+    ).select_from(model.User).join(model.Laboratory, true()).where(
+        model.Laboratory.id.in_(lab_ids),
+        *_bulk_user_filters(user_ids, role)
+    )
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(model.LabAccessPermission).from_select(
+        ["id", "user_id", "laboratory_id", "granted_at", "granted_by"], pairs
+    ).on_conflict_do_nothing(
+        index_elements=["user_id", "laboratory_id"]
+    ).returning(model.LabAccessPermission.user_id)
+    try:
+        granted = [row.user_id for row in db.execute(stmt)]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    reference_cache.invalidate(*[user_permissions_key(user_id) for user_id in set(granted)])
+    targets = count_users(db, user_ids, role) * len(lab_ids)
+    return len(granted), targets - len(granted)
+
+def bulk_revoke_lab_access(
+    db: Session,
+    lab_ids: List[UUID],
+    user_ids: Optional[List[UUID]] = None,
+    role: Optional[str] = None
+) -> Tuple[List[Tuple[UUID, UUID]], int]:
+    """Revoca todos los pares usuario-laboratorio en un solo DELETE, con el rol
+    resuelto en la base de datos. Devuelve ((user_id, laboratory_id) eliminados, omitidos)."""
+    if not lab_ids or user_ids == []:
+        return [], 0
+
+    users = select(model.User.id).where(*_bulk_user_filters(user_ids, role))
+    stmt = delete(model.LabAccessPermission).where(
+        model.LabAccessPermission.laboratory_id.in_(lab_ids),
+        model.LabAccessPermission.user_id.in_(users)
+    ).returning(model.LabAccessPermission.user_id, model.LabAccessPermission.laboratory_id)
+    try:
+        removed = [(row.user_id, row.laboratory_id) for row in db.execute(stmt)]
+        if removed:
+            # Las revocaciones no dejan fila: se registran para que la versión
+            # del paquete de embeddings avance (ver get_lab_embedding_members)
+            db.execute(update(model.Laboratory).where(
+                model.Laboratory.id.in_({lab_id for _, lab_id in removed})
+            ).values(permissions_revoked_at=datetime.utcnow()))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    reference_cache.invalidate(*[user_permissions_key(user_id) for user_id in {user_id for user_id, _ in removed}])
+    targets = count_users(db, user_ids, role) * len(lab_ids)
+    return removed, targets - len(removed)
+
 def check_lab_access_permission(db: Session, user_id: UUID, lab_id: UUID) -> bool:
     permission = db.query(model.LabAccessPermission).filter(
         and_(
@@ -113,10 +388,18 @@ def get_user_lab_permissions(db: Session, user_id: UUID) -> List[model.LabAccess
         model.LabAccessPermission.user_id == user_id
     ).all()
 
+def get_user_lab_permissions_with_labs(db: Session, user_id: UUID) -> List[model.LabAccessPermission]:
+    """Permisos del usuario con su laboratorio cargado en la misma consulta"""
+    return db.query(model.LabAccessPermission).options(
+        joinedload(model.LabAccessPermission.laboratory)
+    ).filter(
+        model.LabAccessPermission.user_id == user_id
+    ).all()
+
 # Access Log CRUD
 def create_access_log(
     db: Session,
-    user_id: UUID,
+    user_id: Optional[UUID],
     lab_id: UUID,
     status: str,
     confidence: Optional[int] = None,
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Type
+import numpy as np
+
+# Ubicación de un rostro: (top, right, bottom, left), igual que face_recognition
+FaceLocation = Tuple[int, int, int, int]
+
+class FaceEngine:
+    """Interfaz de un motor de reconocimiento facial: detectar, codificar y comparar.
+
+    ``dimension`` y ``metric`` se guardan junto a cada embedding para no mezclar
+    galerías producidas por motores incompatibles.
+    """
+
+    name = "base"
+    dimension = 128
+    metric = "euclidean"
+
+    @property
+    def version(self) -> str:
+        """Nombre y configuración; cambia cuando los encodings dejan de ser equivalentes"""
+        return self.name
+
+    def load_image(self, image_bytes: bytes) -> np.ndarray:
+        import face_recognition
+        return face_recognition.load_image_file(io.BytesIO(image_bytes))
+
+    def detect(self, image: np.ndarray) -> List[FaceLocation]:
+        raise NotImplementedError
+
+    def encode(self, image: np.ndarray, locations: List[FaceLocation]) -> List[np.ndarray]:
+        raise NotImplementedError
+
+    def compare(self, known_encodings: np.ndarray, encoding: np.ndarray) -> np.ndarray:
+        """Distancias entre cada encoding conocido y el encoding dado"""
+        known_encodings = np.asarray(known_encodings)
+        if len(known_encodings) == 0:
+            return np.empty(0)
+        return np.linalg.norm(known_encodings - encoding, axis=1)
+
+    def extract(self, image_bytes: bytes) -> np.ndarray:
+        """Extrae el encoding de una imagen con exactamente un rostro"""
+        image = self.load_image(image_bytes)
+        face_locations = self.detect(image)
+
+        if len(face_locations) == 0:
+            raise ValueError("No se detectó ningún rostro en la imagen")
+
+        if len(face_locations) > 1:
+            raise ValueError("Se detectaron múltiples rostros. Por favor, usa una imagen con un solo rostro")
+
+        return self.encode(image, face_locations)[0]
+
+
+class DlibEngine(FaceEngine):
+    """Detector de dlib + encoder ResNet de dlib (128-d, distancia euclidiana)"""
+
+    model = "hog"
+
+    def __init__(self, upsample: int = 1, num_jitters: int = 1):
+        self.upsample = upsample
+        self.num_jitters = num_jitters
+
+    @property
+    def version(self) -> str:
+        return f"{self.name}:upsample={self.upsample}:jitters={self.num_jitters}"
+
+    def detect(self, image: np.ndarray) -> List[FaceLocation]:
+        import face_recognition
+        return face_recognition.face_locations(image, self.upsample, model=self.model)
+
+    def encode(self, image: np.ndarray, locations: List[FaceLocation]) -> List[np.ndarray]:
+        import face_recognition
+        return face_recognition.face_encodings(image, locations, num_jitters=self.num_jitters)
+
+
+class DlibHogEngine(DlibEngine):
+    name = "dlib-hog"
+    model = "hog"
+
+
+class DlibCnnEngine(DlibEngine):
+    name = "dlib-cnn"
+    model = "cnn"
+
+
+class OpenCVHaarEngine(DlibEngine):
+    """Detector Haar de OpenCV (más rápido en CPU) + encoder ResNet de dlib"""
+
+    name = "opencv-haar"
+
+    def __init__(self, upsample: int = 1, num_jitters: int = 1, min_size: int = 60):
+        super().__init__(upsample, num_jitters)
+        self.min_size = min_size
+        self._classifier = None
+
+    def detect(self, image: np.ndarray) -> List[FaceLocation]:
+        import cv2
+        if self._classifier is None:
+            self._classifier = cv2.CascadeClassifier(
+                cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+            )
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        faces = self._classifier.detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(self.min_size, self.min_size)
+        )
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in faces]
+
+
+class StubEngine(FaceEngine):
+    """Motor determinista para pruebas de carga: mapea bytes a encodings reproducibles.
+
+    Las imágenes con la forma ``STUBFACE:<identidad>:<toma>`` (ver
+    util/loadtest.py) producen encodings a ~0.2 de las demás tomas de la misma
+    identidad y a ~1.0 de cualquier otra, como espera el umbral de 0.6.
+    Cualquier otro contenido se trata como una identidad propia. ``cost_ms``
+    simula el costo de CPU de la inferencia real con espera activa.
+
+    Solo para pruebas: no está en ENGINES y no puede elegirse con FACE_ENGINE.
+    """
+
+    name = "stub"
+    prefix = b"STUBFACE:"
+
+    def __init__(self, cost_ms: float = 0.0, noise: float = 0.2):
+        self.cost_ms = cost_ms
+        self.noise = noise
+
+    def _vector(self, seed_bytes: bytes, scale: float) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(seed_bytes).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        return rng.normal(size=self.dimension) * (scale / np.sqrt(self.dimension))
+
+    def load_image(self, image_bytes: bytes) -> bytes:
+        return image_bytes
+
+    def detect(self, image: bytes) -> List[FaceLocation]:
+        if self.cost_ms > 0:
+            deadline = time.perf_counter() + self.cost_ms / 1000.0
+            while time.perf_counter() < deadline:
+                pass
+        return [(0, 0, 0, 0)]
+
+    def encode(self, image: bytes, locations: List[FaceLocation]) -> List[np.ndarray]:
+        if image.startswith(self.prefix):
+            identity, _, shot = image[len(self.prefix):].rpartition(b":")
+        else:
+            identity, shot = image, b""
+        encoding = self._vector(identity, 0.7)
+        if shot:
+            encoding = encoding + self._vector(identity + b"#" + shot, self.noise)
+        return [encoding]
+
+
+# StubEngine no se registra: aceptaría cualquier contenido como rostro. Solo se
+# instala explícitamente con set_engine() (util/loadtest.py)
+ENGINES: Dict[str, Type[FaceEngine]] = {
+    DlibHogEngine.name: DlibHogEngine,
+    DlibCnnEngine.name: DlibCnnEngine,
+    OpenCVHaarEngine.name: OpenCVHaarEngine,
+}
+
+# Motor configurado por variable de entorno
+FACE_ENGINE = os.getenv("FACE_ENGINE", DlibHogEngine.name)
+FACE_NUM_JITTERS = int(os.getenv("FACE_NUM_JITTERS", "1"))
+
+_engine: Optional[FaceEngine] = None
+_engine_lock = threading.Lock()
+
+def build_engine(name: str, **options) -> FaceEngine:
+    if name not in ENGINES:
+        raise ValueError(f"Motor facial desconocido '{name}'. Opciones: {', '.join(ENGINES)}")
+    return ENGINES[name](**options)
+
+def get_engine() -> FaceEngine:
+    """Motor facial activo (FACE_ENGINE)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = build_engine(FACE_ENGINE, num_jitters=FACE_NUM_JITTERS)
+        return _engine
+
+def set_engine(engine: FaceEngine):
+    """Reemplaza el motor activo (p. ej. el motor determinista de util/loadtest.py)"""
+    global _engine
+    with _engine_lock:
+        _engine = engine
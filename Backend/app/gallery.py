@@ -0,0 +1,320 @@
+import threading
+import time
+import os
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import crud
+from .engines import get_engine
+
+# Umbral de distancia facial (menor = más estricto)
+MATCH_THRESHOLD = 0.6
+
+# Segundos tras los cuales una galería se reconstruye completa desde la base de
+# datos. Los cambios de otros workers se detectan antes en cada consulta
+# comparando la firma (cantidad, último cambio) de la galería
+LAB_GALLERY_TTL = float(os.getenv("LAB_GALLERY_TTL", "300"))
+
+# Segundos entre comparaciones de firma de una misma galería: la consulta recorre
+# el índice de embeddings, así que no se repite en cada verificación
+LAB_GALLERY_CHECK_INTERVAL = float(os.getenv("LAB_GALLERY_CHECK_INTERVAL", "1"))
+
+# Precisión de almacenamiento en memoria: float64 (exacta), float16 o int8.
+# int8 ahorra memoria y acelera el recorrido; float16 solo ahorra memoria: numpy
+# no tiene una ruta rápida para convertirlo y el recorrido es más lento que float64
+FACE_INDEX_PRECISION = os.getenv("FACE_INDEX_PRECISION", "float64")
+# Candidatos que se re-ordenan con distancias en precisión completa
+FACE_INDEX_RERANK = int(os.getenv("FACE_INDEX_RERANK", "8"))
+
+# Clave de la galería con toda la población (/api/face/verify)
+ALL_USERS = None
+
+CODE_DTYPES = {"float64": np.float64, "float16": np.float16, "int8": np.int8}
+
+# Filas por bloque al convertir códigos compactos a float32
+_CHUNK_ROWS = 2048
+
+# Margen sobre la cota de error por el redondeo del cálculo de distancias
+_ROUNDING_MARGIN = 1e-5
+
+FullPrecisionLoader = Callable[[List[UUID]], Dict[UUID, np.ndarray]]
+
+class EmbeddingIndex:
+    """Galería de encodings en memoria con almacenamiento opcional en precisión reducida.
+
+    Con float16 o int8 (escala por dimensión) se recorre la galería sobre los
+    códigos compactos y los ``rerank`` mejores candidatos se re-ordenan con la
+    distancia del motor sobre los vectores originales, de modo que la decisión
+    contra el umbral es la misma que con float64. El recorrido aproximado
+    asume distancia euclidiana.
+
+    Las escrituras reemplazan ``_state`` (ids, códigos, normas) de una sola vez,
+    así las búsquedas concurrentes siempre ven una galería consistente.
+    """
+
+    def __init__(self, dimension: int = 128, precision: str = FACE_INDEX_PRECISION,
+                 rerank: int = FACE_INDEX_RERANK):
+        if precision not in CODE_DTYPES:
+            raise ValueError(f"Precisión desconocida '{precision}'. Opciones: {', '.join(CODE_DTYPES)}")
+        self.dimension = dimension
+        self.precision = precision
+        self.rerank = max(1, rerank)
+        self.loaded_at = time.monotonic()
+        # (cantidad, último cambio) de la base de datos con que se cargó la galería
+        self.signature: Optional[Tuple[int, Optional[datetime]]] = None
+        self.checked_at = self.loaded_at
+        # Cota exacta de ||x - decodificado(x)||: |aproximada - exacta| <= _max_error
+        self._max_error = 0.0
+        self._compute_dtype = np.float64 if precision == "float64" else np.float32
+        self._scale: Optional[np.ndarray] = None
+        self._rows: Dict[UUID, int] = {}
+        self._lock = threading.Lock()
+        self._state: Tuple[List[UUID], np.ndarray, np.ndarray] = (
+            [],
+            np.empty((0, dimension), dtype=CODE_DTYPES[precision]),
+            np.empty(0, dtype=self._compute_dtype),
+        )
+
+    def __len__(self):
+        return len(self._state[0])
+
+    @property
+    def user_ids(self) -> List[UUID]:
+        return self._state[0]
+
+    # ---------- Cuantización ----------
+
+    def _fit_scale(self, encodings: np.ndarray):
+        # Margen del 25% para que los vectores agregados después quepan sin recortar
+        max_abs = np.abs(encodings).max(axis=0) if len(encodings) else np.full(self.dimension, 0.5)
+        self._scale = (np.maximum(max_abs, 1e-6) * 1.25 / 127.0).astype(np.float32)
+
+    def _quantize(self, encodings: np.ndarray) -> np.ndarray:
+        if self.precision == "int8":
+            codes = np.rint(encodings / self._scale)
+            return np.clip(codes, -127, 127).astype(np.int8)
+        return encodings.astype(CODE_DTYPES[self.precision])
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        decoded = codes.astype(self._compute_dtype)
+        if self.precision == "int8":
+            decoded *= self._scale
+        return decoded
+
+    def _error(self, encodings: np.ndarray, decoded: np.ndarray) -> float:
+        if self.precision == "float64" or len(encodings) == 0:
+            return 0.0
+        return float(np.linalg.norm(encodings.reshape(decoded.shape) - decoded, axis=-1).max())
+
+    # ---------- Mantenimiento ----------
+
+    def build(self, user_ids: Iterable[UUID], encodings: np.ndarray):
+        """Carga masiva; en int8 ajusta la escala a los datos"""
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.dimension)
+        user_ids = list(user_ids)
+        with self._lock:
+            if self.precision == "int8":
+                self._fit_scale(encodings)
+            codes = self._quantize(encodings)
+            decoded = self._decode(codes)
+            self._max_error = self._error(encodings, decoded)
+            self._rows = {user_id: row for row, user_id in enumerate(user_ids)}
+            self._state = (user_ids, codes, np.einsum("ij,ij->i", decoded, decoded))
+
+    def add(self, user_id: UUID, encoding: np.ndarray):
+        encoding = np.asarray(encoding, dtype=np.float64).reshape(1, -1)
+        with self._lock:
+            if self.precision == "int8" and self._scale is None:
+                self._fit_scale(encoding)
+            code = self._quantize(encoding)
+            decoded = self._decode(code)[0]
+            norm = decoded @ decoded
+            self._max_error = max(self._max_error, self._error(encoding, decoded))
+
+            user_ids, codes, norms = self._state
+            row = self._rows.get(user_id)
+            if row is not None:
+                codes, norms = codes.copy(), norms.copy()
+                codes[row] = code[0]
+                norms[row] = norm
+                self._state = (user_ids, codes, norms)
+                return
+            self._rows[user_id] = len(user_ids)
+            self._state = (user_ids + [user_id], np.vstack([codes, code]), np.append(norms, norm))
+
+    def remove(self, user_id: UUID):
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return
+            # Mover la última fila al hueco en lugar de desplazar toda la galería
+            user_ids, codes, norms = self._state
+            user_ids, codes, norms = user_ids[:], codes.copy(), norms.copy()
+            last = len(user_ids) - 1
+            if row != last:
+                moved = user_ids[last]
+                user_ids[row] = moved
+                self._rows[moved] = row
+                codes[row] = codes[last]
+                norms[row] = norms[last]
+            self._state = (user_ids[:last], codes[:last], norms[:last])
+
+    def memory_bytes(self) -> int:
+        """Memoria ocupada por los códigos, normas y escala"""
+        _, codes, norms = self._state
+        total = codes.nbytes + norms.nbytes
+        if self._scale is not None:
+            total += self._scale.nbytes
+        return total
+
+    # ---------- Búsqueda ----------
+
+    def _approximate_distances(self, codes: np.ndarray, norms: np.ndarray, encoding: np.ndarray) -> np.ndarray:
+        query = np.asarray(encoding, dtype=self._compute_dtype)
+        weights = query * self._scale if self.precision == "int8" else query
+
+        dots = np.empty(len(norms), dtype=self._compute_dtype)
+        for start in range(0, len(dots), _CHUNK_ROWS):
+            block = codes[start:start + _CHUNK_ROWS]
+            dots[start:start + len(block)] = block.astype(self._compute_dtype, copy=False) @ weights
+
+        squared = norms - 2.0 * dots + query @ query
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def approximate_distances(self, encoding: np.ndarray) -> np.ndarray:
+        """Distancias euclidianas calculadas sobre los códigos almacenados"""
+        _, codes, norms = self._state
+        return self._approximate_distances(codes, norms, encoding)
+
+    def search(self, encoding: np.ndarray, threshold: float = MATCH_THRESHOLD,
+               fetch_full: Optional[FullPrecisionLoader] = None) -> Optional[Tuple[UUID, float]]:
+        """Devuelve (user_id, distancia) del mejor match bajo el umbral, o None"""
+        user_ids, codes, norms = self._state
+        if not user_ids:
+            return None
+
+        approximate = self._approximate_distances(codes, norms, encoding)
+        k = min(self.rerank, len(approximate))
+        candidates = np.argpartition(approximate, k - 1)[:k]
+        # Un candidato con distancia aproximada >= umbral + error máximo no puede
+        # quedar bajo el umbral: se descarta sin consultar la base de datos
+        bound = self._max_error + _ROUNDING_MARGIN
+        candidates = candidates[approximate[candidates] - bound < threshold]
+        if len(candidates) == 0:
+            return None
+        candidate_ids = [user_ids[i] for i in candidates]
+
+        if self.precision == "float64":
+            full = codes[candidates]
+        elif fetch_full is not None:
+            vectors = fetch_full(candidate_ids)
+            candidate_ids = [user_id for user_id in candidate_ids if user_id in vectors]
+            if not candidate_ids:
+                return None
+            full = np.array([vectors[user_id] for user_id in candidate_ids])
+        else:
+            full = self._decode(codes[candidates])
+
+        distances = get_engine().compare(full, encoding)
+        best = int(np.argmin(distances))
+        if distances[best] >= threshold:
+            return None
+        return candidate_ids[best], float(distances[best])
+
+
+def full_precision_loader(db: Session) -> FullPrecisionLoader:
+    """Obtiene de la base de datos los encodings originales para el re-ordenamiento"""
+    def load(user_ids: List[UUID]) -> Dict[UUID, np.ndarray]:
+        return {
+            record.user_id: np.array(record.embedding)
+            for record in crud.get_facial_embeddings_by_users(db, user_ids)
+        }
+    return load
+
+
+class GalleryRegistry:
+    """Galerías en memoria por laboratorio (y una con toda la población), cargadas
+    bajo demanda y mantenidas al registrar rostros y otorgar permisos.
+
+    Antes de reutilizar una galería se compara su firma con la de la base de
+    datos (como mucho cada LAB_GALLERY_CHECK_INTERVAL segundos), así los cambios
+    hechos por otros workers se ven casi de inmediato: altas y re-codificaciones
+    se aplican como delta, y las bajas provocan una recarga completa."""
+
+    def __init__(self, ttl: float = LAB_GALLERY_TTL, check_interval: float = LAB_GALLERY_CHECK_INTERVAL):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._galleries: Dict[Optional[UUID], EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, lab_id: Optional[UUID], engine, changed_since: Optional[datetime] = None):
+        if lab_id is ALL_USERS:
+            return crud.get_all_facial_embeddings(db, engine.dimension, engine.metric, changed_since)
+        return crud.get_lab_facial_embeddings(db, lab_id, engine.dimension, engine.metric, changed_since)
+
+    def _refresh(self, db: Session, gallery: EmbeddingIndex, lab_id: Optional[UUID],
+                 signature: Tuple[int, Optional[datetime]], engine) -> bool:
+        """Aplica solo las filas cambiadas desde la última carga. Devuelve False si
+        la galería no cuadra (revocaciones, borrados) y hay que reconstruirla"""
+        since = gallery.signature[1] if gallery.signature else None
+        if since is None:
+            return False
+        for record in self._load(db, lab_id, engine, since):
+            gallery.add(record.user_id, np.array(record.embedding))
+        if len(gallery) != signature[0]:
+            return False
+        gallery.signature = signature
+        return True
+
+    def get(self, db: Session, lab_id: Optional[UUID] = ALL_USERS) -> EmbeddingIndex:
+        engine = get_engine()
+        now = time.monotonic()
+        with self._lock:
+            gallery = self._galleries.get(lab_id)
+        if gallery is not None and now - gallery.loaded_at < self.ttl and now - gallery.checked_at < self.check_interval:
+            return gallery
+
+        signature = crud.get_gallery_signature(db, lab_id, engine.dimension, engine.metric)
+        if gallery is not None and now - gallery.loaded_at < self.ttl:
+            if gallery.signature == signature or self._refresh(db, gallery, lab_id, signature, engine):
+                gallery.checked_at = now
+                return gallery
+
+        records = self._load(db, lab_id, engine)
+        gallery = EmbeddingIndex(engine.dimension)
+        gallery.build(
+            [record.user_id for record in records],
+            np.array([record.embedding for record in records], dtype=np.float64)
+        )
+        gallery.signature = signature
+
+        with self._lock:
+            self._galleries[lab_id] = gallery
+        return gallery
+
+    def add(self, lab_id: Optional[UUID], user_id: UUID, encoding: np.ndarray):
+        """Agrega un usuario a la galería si ya está cargada"""
+        with self._lock:
+            gallery = self._galleries.get(lab_id)
+            if gallery is not None:
+                gallery.add(user_id, encoding)
+
+    def remove(self, lab_id: Optional[UUID], user_id: UUID):
+        with self._lock:
+            gallery = self._galleries.get(lab_id)
+            if gallery is not None:
+                gallery.remove(user_id)
+
+    def invalidate(self, lab_id: Optional[UUID] = None):
+        """Descarta una galería o, sin argumento, todas"""
+        with self._lock:
+            if lab_id is None:
+                self._galleries.clear()
+            else:
+                self._galleries.pop(lab_id, None)
+
+
+galleries = GalleryRegistry()
@@ -1,6 +1,5 @@
 # app/model.py
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, ForeignKey, Text, ARRAY, Float
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, ForeignKey, Text, ARRAY, Float, JSON, Uuid, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
@@ -9,7 +8,7 @@ from .database import Base
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String(255), unique=True, nullable=False, index=True)
     full_name = Column(String(255), nullable=False)
     hashed_password = Column(String(255), nullable=False)
@@ -21,17 +20,18 @@ class User(Base):
 
     # Relaciones
     facial_embedding = relationship("FacialEmbedding", back_populates="user", uselist=False, cascade="all, delete-orphan")
-    access_permissions = relationship("LabAccessPermission", back_populates="user", cascade="all, delete-orphan")
+    access_permissions = relationship("LabAccessPermission", back_populates="user", cascade="all, delete-orphan", foreign_keys="LabAccessPermission.user_id")
     access_logs = relationship("AccessLog", back_populates="user")
 
 
 class Laboratory(Base):
     __tablename__ = "laboratories"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(255), nullable=False)
     location = Column(String(255), nullable=False)
     capacity = Column(Integer, nullable=False)
+    permissions_revoked_at = Column(DateTime)  # Última revocación (versión del paquete de embeddings)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -42,10 +42,16 @@ class Laboratory(Base):
 
 class FacialEmbedding(Base):
     __tablename__ = "facial_embeddings"
-
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
-    embedding = Column(ARRAY(Float), nullable=False)
+    # Cubre la firma de las galerías en memoria (count y max(updated_at) por motor)
+    __table_args__ = (Index("idx_facial_embeddings_space", "embedding_dim", "metric", "updated_at"),)
+
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
+    embedding = Column(ARRAY(Float).with_variant(JSON, "sqlite"), nullable=False)  # JSON en SQLite (pruebas de carga)
+    engine = Column(String(50), nullable=False, default="dlib-hog")  # Motor que generó el embedding
+    engine_version = Column(String(100))  # Motor y configuración (ver util/reencode.py)
+    embedding_dim = Column(Integer, nullable=False, default=128)
+    metric = Column(String(20), nullable=False, default="euclidean")
     image_path = Column(String(500))
     registered_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -56,12 +62,13 @@ class FacialEmbedding(Base):
 
 class LabAccessPermission(Base):
     __tablename__ = "lab_access_permissions"
+    __table_args__ = (UniqueConstraint("user_id", "laboratory_id"),)
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    laboratory_id = Column(UUID(as_uuid=True), ForeignKey("laboratories.id", ondelete="CASCADE"), nullable=False)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    laboratory_id = Column(Uuid(as_uuid=True), ForeignKey("laboratories.id", ondelete="CASCADE"), nullable=False)
     granted_at = Column(DateTime, default=datetime.utcnow)
-    granted_by = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    granted_by = Column(Uuid(as_uuid=True), ForeignKey("users.id"))
 
     # Relaciones
     user = relationship("User", back_populates="access_permissions", foreign_keys=[user_id])
@@ -71,9 +78,9 @@ class LabAccessPermission(Base):
 class AccessLog(Base):
     __tablename__ = "access_logs"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
-    laboratory_id = Column(UUID(as_uuid=True), ForeignKey("laboratories.id"), nullable=False)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id"), nullable=True)  # NULL = rostro no identificado
+    laboratory_id = Column(Uuid(as_uuid=True), ForeignKey("laboratories.id"), nullable=False)
     access_time = Column(DateTime, default=datetime.utcnow, index=True)
     access_status = Column(String(50), nullable=False)
     facial_match_confidence = Column(Integer)
@@ -1,9 +1,8 @@
 # app/router.py
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from uuid import UUID
-import face_recognition
 import numpy as np
 from PIL import Image
 import io
@@ -12,6 +11,10 @@ from pathlib import Path
 
 from . import crud, schemas, model
 from .database import get_db
+from .gallery import galleries, full_precision_loader, ALL_USERS, MATCH_THRESHOLD
+from .engines import get_engine
+from .bundle import pack_bundle, to_version, from_version
+from .cache import cached_response, ALL_LABORATORIES, laboratory_key, user_key, user_permissions_key
 
 api_router = APIRouter()
 
@@ -22,17 +25,7 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 def extract_face_encoding(image_bytes: bytes) -> np.ndarray:
     """Extrae el encoding facial de una imagen"""
     try:
-        image = face_recognition.load_image_file(io.BytesIO(image_bytes))
-        face_locations = face_recognition.face_locations(image)
-        
-        if len(face_locations) == 0:
-            raise ValueError("No se detectó ningún rostro en la imagen")
-        
-        if len(face_locations) > 1:
-            raise ValueError("Se detectaron múltiples rostros. Por favor, usa una imagen con un solo rostro")
-        
-        face_encodings = face_recognition.face_encodings(image, face_locations)
-        return face_encodings[0]
+        return get_engine().extract(image_bytes)
     except Exception as e:
         raise ValueError(f"Error al procesar la imagen: {str(e)}")
 
@@ -117,16 +110,25 @@ async def register_face(
         
         # Guardar embedding en base de datos
         encoding_list = encoding.tolist()
+        engine = get_engine()
         crud.create_facial_embedding(
             db=db,
             user_id=user_uuid,
             embedding=encoding_list,
-            image_path=image_path
+            image_path=image_path,
+            engine=engine.name,
+            metric=engine.metric,
+            engine_version=engine.version
         )
         
         # Actualizar estado del usuario
         crud.update_user_facial_status(db, user_uuid, True)
         
+        # Agregar a la galería general y a las de los laboratorios que ya tiene permitidos
+        galleries.add(ALL_USERS, user_uuid, encoding)
+        for perm in crud.get_user_lab_permissions(db, user_uuid):
+            galleries.add(perm.laboratory_id, user_uuid, encoding)
+        
         return schemas.FaceRegisterResponse(
             success=True,
             message="Rostro registrado exitosamente",
@@ -151,35 +153,25 @@ async def verify_face(
         # Extraer encoding del rostro a verificar
         unknown_encoding = extract_face_encoding(image_bytes)
         
-        # Obtener todos los encodings de la base de datos
-        all_embeddings = crud.get_all_facial_embeddings(db)
+        # Galería en memoria con todos los encodings comparables con el motor activo
+        gallery = galleries.get(db, ALL_USERS)
         
-        if not all_embeddings:
+        if len(gallery) == 0:
             return schemas.FaceVerifyResponse(
                 success=True,
                 match_found=False,
                 message="No hay rostros registrados en el sistema"
             )
         
-        best_match = None
-        best_distance = float('inf')
-        threshold = 0.6  # Umbral de distancia (menor = más estricto)
+        match = gallery.search(unknown_encoding, MATCH_THRESHOLD, full_precision_loader(db))
         
-        for embedding_record in all_embeddings:
-            stored_encoding = np.array(embedding_record.embedding)
-            
-            # Calcular distancia facial
-            distance = face_recognition.face_distance([stored_encoding], unknown_encoding)[0]
+        if match:
+            best_user_id, best_distance = match
             
-            if distance < threshold and distance < best_distance:
-                best_distance = distance
-                best_match = embedding_record
-        
-        if best_match:
             # Calcular confianza (inversa de la distancia, normalizada a porcentaje)
             confidence = int((1 - best_distance) * 100)
             
-            user = crud.get_user_by_id(db, best_match.user_id)
+            user = crud.get_user_by_id(db, best_user_id)
             
             return schemas.FaceVerifyResponse(
                 success=True,
@@ -243,8 +235,24 @@ async def check_lab_access(
                 reason="Usuario no tiene datos faciales registrados"
             )
         
+        # No comparar embeddings de un motor incompatible con el activo
+        engine = get_engine()
+        if user_embedding.embedding_dim != engine.dimension or user_embedding.metric != engine.metric:
+            crud.create_access_log(
+                db=db,
+                user_id=user_uuid,
+                lab_id=lab_uuid,
+                status="denied",
+                reason="Datos faciales generados con un motor incompatible"
+            )
+            return schemas.AccessCheckResponse(
+                status="denied",
+                message="Acceso denegado",
+                reason="Datos faciales generados con un motor incompatible"
+            )
+
         stored_encoding = np.array(user_embedding.embedding)
-        distance = face_recognition.face_distance([stored_encoding], unknown_encoding)[0]
+        distance = engine.compare([stored_encoding], unknown_encoding)[0]
         
         if distance < 0.6:  # Match encontrado
             confidence = int((1 - distance) * 100)
@@ -305,6 +313,76 @@ async def check_lab_access(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al verificar acceso: {str(e)}")
 
+@api_router.post("/face/identify-lab-access", response_model=schemas.LabIdentifyResponse)
+async def identify_lab_access(
+    lab_id: str = Form(...),
+    image: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Identificar (1:N) a una persona en la puerta de un laboratorio sin user_id"""
+    try:
+        lab_uuid = UUID(lab_id)
+        
+        # Verificar que el laboratorio existe
+        db_lab = crud.get_laboratory_by_id(db, lab_uuid)
+        if not db_lab:
+            raise HTTPException(status_code=404, detail="Laboratorio no encontrado")
+        
+        # Leer la imagen
+        image_bytes = await image.read()
+        unknown_encoding = extract_face_encoding(image_bytes)
+        
+        # Buscar solo entre los usuarios autorizados en este laboratorio
+        gallery = galleries.get(db, lab_uuid)
+        match = gallery.search(unknown_encoding, MATCH_THRESHOLD, full_precision_loader(db))
+        
+        # Confirmar el permiso en la base de datos (otro worker pudo revocarlo)
+        if match is not None and not crud.check_lab_access_permission(db, match[0], lab_uuid):
+            galleries.remove(lab_uuid, match[0])
+            match = None
+        
+        if match is None:
+            crud.create_access_log(
+                db=db,
+                user_id=None,
+                lab_id=lab_uuid,
+                status="denied",
+                reason="Rostro no identificado entre los usuarios autorizados"
+            )
+            return schemas.LabIdentifyResponse(
+                status="denied",
+                match_found=False,
+                message="Acceso denegado",
+                reason="Rostro no identificado entre los usuarios autorizados"
+            )
+        
+        user_uuid, distance = match
+        confidence = int((1 - distance) * 100)
+        user = crud.get_user_by_id(db, user_uuid)
+        
+        crud.create_access_log(
+            db=db,
+            user_id=user_uuid,
+            lab_id=lab_uuid,
+            status="granted",
+            confidence=confidence
+        )
+        
+        return schemas.LabIdentifyResponse(
+            status="granted",
+            match_found=True,
+            user=schemas.UserResponse.from_orm(user),
+            confidence=confidence,
+            message="Acceso concedido"
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al identificar rostro: {str(e)}")
+
 # ==================== USER ENDPOINTS ====================
 
 @api_router.get("/users", response_model=List[schemas.UserResponse])
@@ -314,12 +392,15 @@ def get_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return users
 
 @api_router.get("/users/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: UUID, db: Session = Depends(get_db)):
+def get_user(user_id: UUID, request: Request, db: Session = Depends(get_db)):
     """Obtener información de un usuario"""
-    user = crud.get_user_by_id(db, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
+    def load():
+        user = crud.get_user_by_id(db, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        return schemas.UserResponse.from_orm(user)
+    
+    return cached_response(request, user_key(user_id), load)
 
 # ==================== LABORATORY ENDPOINTS ====================
 
@@ -329,17 +410,59 @@ def create_lab(lab: schemas.LaboratoryCreate, db: Session = Depends(get_db)):
     return crud.create_laboratory(db=db, lab=lab)
 
 @api_router.get("/laboratories", response_model=List[schemas.LaboratoryResponse])
-def get_laboratories(db: Session = Depends(get_db)):
+def get_laboratories(request: Request, db: Session = Depends(get_db)):
     """Obtener lista de laboratorios"""
-    return crud.get_all_laboratories(db)
+    return cached_response(request, ALL_LABORATORIES, lambda: [
+        schemas.LaboratoryResponse.from_orm(lab) for lab in crud.get_all_laboratories(db)
+    ])
 
 @api_router.get("/laboratories/{lab_id}", response_model=schemas.LaboratoryResponse)
-def get_laboratory(lab_id: UUID, db: Session = Depends(get_db)):
+def get_laboratory(lab_id: UUID, request: Request, db: Session = Depends(get_db)):
     """Obtener información de un laboratorio"""
+    def load():
+        lab = crud.get_laboratory_by_id(db, lab_id)
+        if not lab:
+            raise HTTPException(status_code=404, detail="Laboratorio no encontrado")
+        return schemas.LaboratoryResponse.from_orm(lab)
+    
+    return cached_response(request, laboratory_key(lab_id), load)
+
+@api_router.get("/laboratories/{lab_id}/embeddings-bundle")
+def get_laboratory_embeddings_bundle(
+    lab_id: UUID,
+    since: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Paquete binario con los encodings de los usuarios autorizados (kioscos sin conexión).
+    
+    Con ``since`` (versión de un paquete anterior) devuelve solo los cambios y la
+    lista de miembros actuales, que el kiosco debe aplicar siempre. El formato
+    está descrito en app/bundle.py.
+    """
     lab = crud.get_laboratory_by_id(db, lab_id)
     if not lab:
         raise HTTPException(status_code=404, detail="Laboratorio no encontrado")
-    return lab
+    
+    engine = get_engine()
+    members, last_change = crud.get_lab_embedding_members(db, lab_id, engine.dimension, engine.metric)
+    version = to_version(last_change)
+    
+    changed_since = from_version(since) if since else None
+    rows = crud.get_lab_embedding_changes(db, lab_id, changed_since, engine.dimension, engine.metric)
+    
+    content = pack_bundle(
+        dimension=engine.dimension,
+        user_ids=[user_id for user_id, _ in rows],
+        encodings=np.array([embedding for _, embedding in rows], dtype=np.float32),
+        version=version,
+        since=since or 0,
+        members=members if since else None
+    )
+    return Response(
+        content=content,
+        media_type="application/octet-stream",
+        headers={"X-Bundle-Version": str(version), "X-Bundle-Engine": engine.name}
+    )
 
 # ==================== ACCESS PERMISSION ENDPOINTS ====================
 
@@ -367,29 +490,89 @@ def grant_access(
     
     permission = crud.grant_lab_access(db, user_id, lab_id, granted_by)
     
+    # Mantener la sub-galería del laboratorio
+    embedding = crud.get_facial_embedding_by_user(db, user_id)
+    if embedding:
+        galleries.add(lab_id, user_id, np.array(embedding.embedding))
+    
     return {
         "success": True,
         "message": "Permiso otorgado exitosamente",
         "permission_id": permission.id
     }
 
+def _resolve_bulk_targets(request: schemas.BulkPermissionRequest, db: Session):
+    """Valida los usuarios y laboratorios de una operación masiva. Los usuarios de
+    un rol no se cargan: el INSERT/DELETE los resuelve en la base de datos"""
+    if request.user_ids is None and request.role is None:
+        raise HTTPException(status_code=400, detail="Debe indicar user_ids o role")
+    
+    lab_ids = set(request.lab_ids)
+    found_labs = crud.get_laboratory_ids(db, list(lab_ids))
+    if len(found_labs) != len(lab_ids):
+        raise HTTPException(status_code=404, detail="Laboratorio no encontrado")
+    
+    user_ids = None if request.user_ids is None else list(set(request.user_ids))
+    if user_ids is not None and request.role is None and crud.count_users(db, user_ids) != len(user_ids):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    
+    return user_ids, found_labs
+
+@api_router.post("/permissions/bulk-grant", response_model=schemas.BulkPermissionResponse)
+def bulk_grant_access(request: schemas.BulkPermissionRequest, db: Session = Depends(get_db)):
+    """Otorgar permisos a varios usuarios (o a un rol) en varios laboratorios"""
+    user_ids, lab_ids = _resolve_bulk_targets(request, db)
+    if request.granted_by is not None and not crud.get_user_by_id(db, request.granted_by):
+        raise HTTPException(status_code=404, detail="Usuario que otorga el permiso no encontrado")
+    
+    created, skipped = crud.bulk_grant_lab_access(db, lab_ids, user_ids, request.role, request.granted_by)
+    
+    # Las sub-galerías afectadas se recargan en la siguiente consulta
+    for lab_id in lab_ids:
+        galleries.invalidate(lab_id)
+    
+    return schemas.BulkPermissionResponse(
+        success=True,
+        message="Permisos otorgados exitosamente",
+        created=created,
+        skipped=skipped
+    )
+
+@api_router.post("/permissions/bulk-revoke", response_model=schemas.BulkPermissionResponse)
+def bulk_revoke_access(request: schemas.BulkPermissionRequest, db: Session = Depends(get_db)):
+    """Revocar permisos de varios usuarios (o de un rol) en varios laboratorios"""
+    user_ids, lab_ids = _resolve_bulk_targets(request, db)
+    removed, skipped = crud.bulk_revoke_lab_access(db, lab_ids, user_ids, request.role)
+    
+    for user_id, lab_id in removed:
+        galleries.remove(lab_id, user_id)
+    
+    return schemas.BulkPermissionResponse(
+        success=True,
+        message="Permisos revocados exitosamente",
+        removed=len(removed),
+        skipped=skipped
+    )
+
 @api_router.get("/permissions/user/{user_id}")
-def get_user_permissions(user_id: UUID, db: Session = Depends(get_db)):
+def get_user_permissions(user_id: UUID, request: Request, db: Session = Depends(get_db)):
     """Obtener permisos de acceso de un usuario"""
-    permissions = crud.get_user_lab_permissions(db, user_id)
-    
-    result = []
-    for perm in permissions:
-        lab = crud.get_laboratory_by_id(db, perm.laboratory_id)
-        result.append({
-            "permission_id": perm.id,
-            "laboratory_id": perm.laboratory_id,
-            "laboratory_name": lab.name,
-            "laboratory_location": lab.location,
-            "granted_at": perm.granted_at
-        })
+    def load():
+        permissions = crud.get_user_lab_permissions_with_labs(db, user_id)
+        
+        result = []
+        for perm in permissions:
+            lab = perm.laboratory
+            result.append({
+                "permission_id": perm.id,
+                "laboratory_id": perm.laboratory_id,
+                "laboratory_name": lab.name,
+                "laboratory_location": lab.location,
+                "granted_at": perm.granted_at
+            })
+        return result
     
-    return result
+    return cached_response(request, user_permissions_key(user_id), load)
 
 # ==================== ACCESS LOG ENDPOINTS ====================
 
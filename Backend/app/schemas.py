@@ -67,10 +67,38 @@ class AccessCheckResponse(BaseModel):
     message: str
     reason: Optional[str] = None
 
+class LabIdentifyResponse(BaseModel):
+    status: str
+    match_found: bool
+    user: Optional[UserResponse] = None
+    confidence: Optional[int] = None
+    message: str
+    reason: Optional[str] = None
+
+# Access Permission Schemas
+class BulkPermissionRequest(BaseModel):
+    lab_ids: List[UUID]
+    user_ids: Optional[List[UUID]] = None
+    role: Optional[str] = None
+    granted_by: Optional[UUID] = None
+
+    @validator('role')
+    def validate_role(cls, v):
+        if v is not None and v not in ['student', 'instructor', 'admin']:
+            raise ValueError('Role must be student, instructor, or admin')
+        return v
+
+class BulkPermissionResponse(BaseModel):
+    success: bool
+    message: str
+    created: int = 0
+    removed: int = 0
+    skipped: int = 0
+
 # Access Log Schemas
 class AccessLogResponse(BaseModel):
     id: UUID
-    user_id: UUID
+    user_id: Optional[UUID]
     laboratory_id: UUID
     laboratory_name: str
     access_time: datetime
@@ -23,6 +23,7 @@ CREATE TABLE laboratories (
     name VARCHAR(255) NOT NULL,
     location VARCHAR(255) NOT NULL,
     capacity INTEGER NOT NULL,
+    permissions_revoked_at TIMESTAMP, -- Última revocación de permisos (versión del paquete de embeddings)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -33,6 +34,10 @@ CREATE TABLE facial_embeddings (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     embedding FLOAT8[] NOT NULL, -- Array de 128 floats para el encoding facial
+    engine VARCHAR(50) NOT NULL DEFAULT 'dlib-hog', -- Motor facial que generó el embedding
+    engine_version VARCHAR(100), -- Motor y configuración con que se calculó
+    embedding_dim INTEGER NOT NULL DEFAULT 128,
+    metric VARCHAR(20) NOT NULL DEFAULT 'euclidean',
     image_path VARCHAR(500), -- Ruta local de la imagen
     registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -52,7 +57,7 @@ CREATE TABLE lab_access_permissions (
 -- Tabla de logs de acceso
 CREATE TABLE access_logs (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-    user_id UUID NOT NULL REFERENCES users(id),
+    user_id UUID REFERENCES users(id), -- NULL cuando el rostro no se pudo identificar
     laboratory_id UUID NOT NULL REFERENCES laboratories(id),
     access_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     access_status VARCHAR(50) NOT NULL CHECK (access_status IN ('granted', 'denied')),
@@ -66,6 +71,7 @@ CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_users_status ON users(status);
 CREATE INDEX idx_facial_embeddings_user ON facial_embeddings(user_id);
+CREATE INDEX idx_facial_embeddings_space ON facial_embeddings(embedding_dim, metric, updated_at);
 CREATE INDEX idx_lab_permissions_user ON lab_access_permissions(user_id);
 CREATE INDEX idx_lab_permissions_lab ON lab_access_permissions(laboratory_id);
 CREATE INDEX idx_access_logs_user ON access_logs(user_id);
@@ -73,11 +79,13 @@ CREATE INDEX idx_access_logs_lab ON access_logs(laboratory_id);
 CREATE INDEX idx_access_logs_time ON access_logs(access_time DESC);
 CREATE INDEX idx_access_logs_status ON access_logs(access_status);
 
--- Función para actualizar updated_at automáticamente
+-- Función para actualizar updated_at automáticamente.
+-- Hora actual en UTC (como datetime.utcnow() en la API), no la de inicio de la
+-- transacción: las galerías y los paquetes de embeddings comparan estas fechas
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
 BEGIN
-    NEW.updated_at = CURRENT_TIMESTAMP;
+    NEW.updated_at = clock_timestamp() AT TIME ZONE 'UTC';
     RETURN NEW;
 END;
 $$ language 'plpgsql';
@@ -165,4 +173,23 @@ SELECT 'Base de datos creada exitosamente' AS status;
 SELECT COUNT(*) AS total_usuarios FROM users;
 SELECT COUNT(*) AS total_laboratorios FROM laboratories;
 SELECT COUNT(*) AS total_permisos FROM lab_access_permissions;
-SELECT COUNT(*) AS total_logs FROM access_logs;
\ No newline at end of file
+SELECT COUNT(*) AS total_logs FROM access_logs;
+
+-- ==================== MIGRACIÓN DE BASES EXISTENTES ====================
+-- create_all (app/__init__.py) no agrega columnas a tablas que ya existen.
+-- En una base creada con una versión anterior de este script, ejecutar:
+--
+-- Motor facial de cada embedding (los existentes son de dlib, 128-d euclidiana)
+-- ALTER TABLE facial_embeddings ADD COLUMN engine VARCHAR(50) NOT NULL DEFAULT 'dlib-hog';
+-- ALTER TABLE facial_embeddings ADD COLUMN embedding_dim INTEGER NOT NULL DEFAULT 128;
+-- ALTER TABLE facial_embeddings ADD COLUMN metric VARCHAR(20) NOT NULL DEFAULT 'euclidean';
+-- ALTER TABLE facial_embeddings ADD COLUMN engine_version VARCHAR(100);
+--
+-- Registros de rostros no identificados en la puerta (user_id NULL)
+-- ALTER TABLE access_logs ALTER COLUMN user_id DROP NOT NULL;
+--
+-- Firma de las galerías en memoria (app/gallery.py)
+-- CREATE INDEX idx_facial_embeddings_space ON facial_embeddings(embedding_dim, metric, updated_at);
+--
+-- Versión de los paquetes de embeddings: última revocación por laboratorio
+-- ALTER TABLE laboratories ADD COLUMN permissions_revoked_at TIMESTAMP;
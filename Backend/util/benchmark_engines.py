@@ -0,0 +1,104 @@
+"""Compara la latencia por etapa de los motores faciales sobre un mismo set de imágenes.
+
+Uso (desde Backend/):
+
+    python -m util.benchmark_engines fotos/ --engines dlib-hog,dlib-cnn,opencv-haar --repeat 3
+
+Mide por imagen: carga, detección, codificación y comparación contra la
+galería formada por los encodings del propio set. No requiere base de datos.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app.engines import ENGINES, build_engine
+
+STAGES = ["load", "detect", "encode", "compare"]
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def benchmark_engine(engine, images: List[bytes], repeat: int) -> Dict[str, dict]:
+    timings = {stage: [] for stage in STAGES}
+    detected = 0
+    encodings = []
+
+    for _ in range(repeat):
+        for image_bytes in images:
+            start = time.perf_counter()
+            image = engine.load_image(image_bytes)
+            timings["load"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            locations = engine.detect(image)
+            timings["detect"].append(time.perf_counter() - start)
+
+            if len(locations) != 1:
+                continue
+            detected += 1
+
+            start = time.perf_counter()
+            encodings.append(engine.encode(image, locations)[0])
+            timings["encode"].append(time.perf_counter() - start)
+
+    gallery = np.array(encodings[:len(images)])
+    for encoding in encodings:
+        start = time.perf_counter()
+        engine.compare(gallery, encoding)
+        timings["compare"].append(time.perf_counter() - start)
+
+    result = {
+        "engine": engine.name,
+        "dimension": engine.dimension,
+        "metric": engine.metric,
+        "single_face_rate": detected / (len(images) * repeat),
+    }
+    for stage, values in timings.items():
+        values_ms = np.array(values) * 1000.0 if values else np.zeros(1)
+        result[stage] = {
+            "mean_ms": float(values_ms.mean()),
+            "p95_ms": float(np.percentile(values_ms, 95)),
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de motores de reconocimiento facial")
+    parser.add_argument("image_dir", type=Path, help="Carpeta con imágenes (se recorre recursivamente)")
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help=f"Motores a comparar. Opciones: {', '.join(ENGINES)}")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="Guardar resultados en JSON")
+    args = parser.parse_args(argv)
+
+    paths = sorted(p for p in args.image_dir.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise SystemExit(f"No se encontraron imágenes en {args.image_dir}")
+    images = [p.read_bytes() for p in paths]
+
+    results = []
+    for name in args.engines.split(","):
+        engine = build_engine(name.strip())
+        # Calentamiento (carga de modelos)
+        engine.detect(engine.load_image(images[0]))
+        results.append(benchmark_engine(engine, images, args.repeat))
+
+    print(f"\n{len(images)} imágenes x {args.repeat} repeticiones\n")
+    header = f"{'motor':<14}{'1 rostro':>10}" + "".join(f"{s + ' ms':>16}" for s in STAGES)
+    print(header)
+    print(f"{'':<24}" + "".join(f"{'media / p95':>16}" for _ in STAGES))
+    print("-" * len(header))
+    for r in results:
+        row = f"{r['engine']:<14}{r['single_face_rate'] * 100:>9.1f}%"
+        row += "".join(f"{r[s]['mean_ms']:>9.1f} /{r[s]['p95_ms']:>5.1f}" for s in STAGES)
+        print(row)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Mide memoria y velocidad del índice de embeddings en float64, float16 e int8.
+
+Uso (desde Backend/):
+
+    python -m util.benchmark_index --gallery 200000 --queries 500
+
+Usa una galería sintética de vectores 128-d con la escala de los encodings de
+dlib. Las consultas son tomas ruidosas de personas de la galería y rostros
+desconocidos, y se verifica que la decisión contra el umbral coincida con la
+búsqueda exacta en float64.
+
+Los encodings se guardan en una base SQLite temporal (o en --database-url) y el
+re-ordenamiento de float16/int8 los consulta con full_precision_loader, igual
+que los endpoints, de modo que el tiempo de búsqueda incluye ese viaje a la base.
+También se mide la consulta de firma con que GalleryRegistry detecta cambios; la
+columna "con firma" la suma a cada búsqueda (el peor caso: en la API se ejecuta
+como mucho una vez cada LAB_GALLERY_CHECK_INTERVAL segundos por galería) y el
+speedup se calcula sobre ella.
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, model
+from app.gallery import CODE_DTYPES, MATCH_THRESHOLD, EmbeddingIndex, full_precision_loader
+
+INSERT_BATCH = 5000
+
+
+def synthetic_gallery(size: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.normal(size=(size, dimension)) * (0.7 / np.sqrt(dimension))
+
+
+def synthetic_queries(gallery: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    dimension = gallery.shape[1]
+    known = gallery[rng.integers(0, len(gallery), count // 2)]
+    known = known + rng.normal(size=known.shape) * (0.2 / np.sqrt(dimension))
+    unknown = synthetic_gallery(count - len(known), dimension, rng)
+    return np.vstack([known, unknown])
+
+
+def store_gallery(database_url: str, user_ids, vectors: np.ndarray):
+    """Crea las tablas y guarda los encodings para el re-ordenamiento"""
+    engine = create_engine(database_url)
+    model.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for start in range(0, len(user_ids), INSERT_BATCH):
+            connection.execute(insert(model.FacialEmbedding), [
+                {"user_id": user_id, "embedding": vector.tolist(), "embedding_dim": len(vector)}
+                for user_id, vector in zip(user_ids[start:start + INSERT_BATCH], vectors[start:start + INSERT_BATCH])
+            ])
+    return sessionmaker(bind=engine)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del índice de embeddings cuantizado")
+    parser.add_argument("--gallery", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--rerank", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="Base para los encodings completos (por defecto SQLite temporal)")
+    parser.add_argument("--json", type=Path, help="Guardar resultados en JSON")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_gallery(args.gallery, args.dimension, rng)
+    queries = synthetic_queries(vectors, args.queries, rng)
+    user_ids = [uuid4() for _ in range(args.gallery)]
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/benchmark_index.db"
+    session_factory = store_gallery(database_url, user_ids, vectors)
+
+    # Decisiones de referencia: búsqueda exacta por fuerza bruta
+    expected = []
+    for query in queries:
+        distances = np.linalg.norm(vectors - query, axis=1)
+        best = int(np.argmin(distances))
+        expected.append(user_ids[best] if distances[best] < MATCH_THRESHOLD else None)
+
+    signature_times = []
+    with session_factory() as db:
+        for _ in range(min(len(queries), 50)):
+            start = time.perf_counter()
+            crud.get_gallery_signature(db, None, args.dimension, "euclidean")
+            signature_times.append(time.perf_counter() - start)
+    signature_ms = float(np.mean(signature_times) * 1000)
+
+    results = []
+    for precision in CODE_DTYPES:
+        index = EmbeddingIndex(args.dimension, precision=precision, rerank=args.rerank)
+        index.build(user_ids, vectors)
+
+        scan_times, total_times, agree, fetches = [], [], 0, 0
+        with session_factory() as db:
+            load = full_precision_loader(db)
+
+            def fetch_full(ids):
+                nonlocal fetches
+                fetches += 1
+                return load(ids)
+
+            for query, reference in zip(queries, expected):
+                start = time.perf_counter()
+                index.approximate_distances(query)
+                scan_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                match = index.search(query, MATCH_THRESHOLD, fetch_full)
+                total_times.append(time.perf_counter() - start)
+                agree += (match[0] if match else None) == reference
+                db.expunge_all()
+
+        results.append({
+            "precision": precision,
+            "memory_mb": index.memory_bytes() / 2 ** 20,
+            "bytes_per_face": index.memory_bytes() / args.gallery,
+            "scan_ms": float(np.mean(scan_times) * 1000),
+            "search_ms": float(np.mean(total_times) * 1000),
+            "search_p95_ms": float(np.percentile(total_times, 95) * 1000),
+            "with_signature_ms": float(np.mean(total_times) * 1000) + signature_ms,
+            "db_fetch_rate": fetches / len(queries),
+            "decision_agreement": agree / len(queries),
+        })
+
+    baseline = results[0]
+    print(f"\nGalería de {args.gallery} x {args.dimension}-d, {len(queries)} consultas, re-rank {args.rerank}")
+    print(f"Consulta de firma: {signature_ms:.2f} ms\n")
+    header = (f"{'precisión':<10}{'MB':>9}{'B/rostro':>10}{'scan ms':>10}{'búsqueda ms':>13}"
+              f"{'p95 ms':>9}{'con firma':>11}{'speedup':>9}{'acuerdo':>9}{'a la BD':>9}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        r["signature_ms"] = signature_ms
+        r["speedup"] = baseline["with_signature_ms"] / r["with_signature_ms"]
+        print(f"{r['precision']:<10}{r['memory_mb']:>9.1f}{r['bytes_per_face']:>10.0f}{r['scan_ms']:>10.2f}"
+              f"{r['search_ms']:>13.2f}{r['search_p95_ms']:>9.2f}{r['with_signature_ms']:>11.2f}{r['speedup']:>8.2f}x"
+              f"{r['decision_agreement'] * 100:>8.1f}%{r['db_fetch_rate'] * 100:>8.1f}%")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
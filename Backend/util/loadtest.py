@@ -0,0 +1,350 @@
+"""Pruebas de carga de los endpoints /api/face/* y /api/logs.
+
+Uso (desde Backend/):
+
+    python -m util.loadtest --requests 2000 --concurrency 16 \
+        --mix register=1,verify=4,check-lab-access=4,identify=2,logs=1
+
+Sin --url levanta la app en un hilo (uvicorn sobre localhost) contra una base
+SQLite temporal con el motor determinista StubEngine (app/engines.py), de modo
+que no se necesita Postgres ni dlib. Con --url se ataca un servidor ya
+desplegado con su motor real; en ese caso --image-dir es obligatorio y se
+envían fotos reales.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+OPERATIONS = ["register", "verify", "check-lab-access", "identify", "logs"]
+
+STUB_PREFIX = b"STUBFACE:"
+
+
+def make_stub_image(identity: str, shot: int) -> bytes:
+    """Imagen sintética en el formato que entiende StubEngine (app/engines.py)"""
+    return STUB_PREFIX + f"{identity}:{shot}".encode()
+
+
+# ==================== CLIENTE HTTP ====================
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """Cliente HTTP con una conexión keep-alive por hilo"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        conn = self._connection()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        return self.request("GET", path)
+
+    def post_json(self, path: str, payload: dict) -> Tuple[int, bytes]:
+        return self.request("POST", path, json.dumps(payload).encode(),
+                            {"Content-Type": "application/json"})
+
+    def post_form(self, path: str, fields: Dict[str, str], image: bytes) -> Tuple[int, bytes]:
+        body, content_type = encode_multipart(fields, {"image": ("face.jpg", image)})
+        return self.request("POST", path, body, {"Content-Type": content_type})
+
+
+# ==================== ESCENARIO ====================
+
+class Scenario:
+    """Usuarios, laboratorios y permisos creados antes de medir"""
+
+    def __init__(self, client: Client, image_source):
+        self.client = client
+        self.image_source = image_source
+        self.labs: List[str] = []
+        self.registered: List[str] = []
+        self.pending: List[str] = []
+        self._lock = threading.Lock()
+        self._shots = defaultdict(int)
+
+    def image_for(self, user_id: str) -> bytes:
+        with self._lock:
+            self._shots[user_id] += 1
+            shot = self._shots[user_id]
+        return self.image_source(user_id, shot)
+
+    def _create_user(self, run_id: str, index: int) -> str:
+        status, body = self.client.post_json("/api/auth/register", {
+            "email": f"load{index}-{run_id}@loadtest.udal.edu.co",
+            "full_name": f"Load User {index}",
+            "role": "student",
+            "password": "password123",
+        })
+        if status != 200:
+            raise RuntimeError(f"No se pudo crear usuario de prueba: {status} {body[:200]!r}")
+        return json.loads(body)["id"]
+
+    def setup(self, labs: int, users: int, register_pool: int, permission_ratio: float):
+        run_id = uuid.uuid4().hex[:8]
+        for i in range(labs):
+            status, body = self.client.post_json("/api/laboratories", {
+                "name": f"Load Lab {i} ({run_id})", "location": "loadtest", "capacity": 30,
+            })
+            if status != 200:
+                raise RuntimeError(f"No se pudo crear laboratorio: {status} {body[:200]!r}")
+            self.labs.append(json.loads(body)["id"])
+
+        admin_id = self._create_user(run_id, -1)
+        for i in range(users):
+            user_id = self._create_user(run_id, i)
+            status, body = self.client.post_form(
+                "/api/face/register", {"user_id": user_id}, self.image_for(user_id)
+            )
+            if status != 200:
+                raise RuntimeError(f"No se pudo registrar rostro: {status} {body[:200]!r}")
+            self.registered.append(user_id)
+            for lab_id in self.labs:
+                if random.random() < permission_ratio:
+                    self.client.request(
+                        "POST",
+                        f"/api/permissions/grant?user_id={user_id}&lab_id={lab_id}&granted_by={admin_id}",
+                    )
+
+        for i in range(register_pool):
+            self.pending.append(self._create_user(run_id, users + i))
+
+    def next_pending(self) -> Optional[str]:
+        with self._lock:
+            return self.pending.pop() if self.pending else None
+
+    def run(self, operation: str) -> Tuple[int, bytes]:
+        if operation == "register":
+            user_id = self.next_pending()
+            if user_id is None:
+                raise RuntimeError("Sin usuarios pendientes de registro")
+            result = self.client.post_form("/api/face/register", {"user_id": user_id}, self.image_for(user_id))
+            if result[0] == 200:
+                with self._lock:
+                    self.registered.append(user_id)
+            return result
+        if operation == "verify":
+            user_id = random.choice(self.registered)
+            return self.client.post_form("/api/face/verify", {}, self.image_for(user_id))
+        if operation == "check-lab-access":
+            user_id = random.choice(self.registered)
+            fields = {"user_id": user_id, "lab_id": random.choice(self.labs)}
+            return self.client.post_form("/api/face/check-lab-access", fields, self.image_for(user_id))
+        if operation == "identify":
+            user_id = random.choice(self.registered)
+            fields = {"lab_id": random.choice(self.labs)}
+            return self.client.post_form("/api/face/identify-lab-access", fields, self.image_for(user_id))
+        if operation == "logs":
+            return self.client.get("/api/logs?limit=50")
+        raise ValueError(f"Operación desconocida: {operation}")
+
+
+# ==================== EJECUCIÓN Y REPORTE ====================
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Operación desconocida '{name}'. Opciones: {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def run_load(scenario: Scenario, mix: Dict[str, float], total: int, concurrency: int) -> Tuple[dict, float]:
+    operations = random.choices(list(mix), weights=list(mix.values()), k=total)
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def execute(operation: str):
+        start = time.perf_counter()
+        try:
+            status, _ = scenario.run(operation)
+            ok = 200 <= status < 300
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[operation].append(elapsed)
+            if not ok:
+                errors[operation] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(execute, operations))
+    wall = time.perf_counter() - started
+
+    report = {}
+    for operation, latencies in samples.items():
+        values = np.array(latencies) * 1000.0
+        report[operation] = {
+            "requests": len(values),
+            "throughput_rps": len(values) / wall,
+            "error_rate": errors[operation] / len(values),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max()),
+        }
+    return report, wall
+
+
+def print_report(report: dict, wall: float, total: int):
+    print(f"\n{total} solicitudes en {wall:.2f}s ({total / wall:.1f} req/s)\n")
+    header = f"{'endpoint':<18}{'n':>7}{'req/s':>9}{'err%':>8}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}"
+    print(header)
+    print("-" * len(header))
+    for operation in OPERATIONS:
+        if operation not in report:
+            continue
+        r = report[operation]
+        print(f"{operation:<18}{r['requests']:>7}{r['throughput_rps']:>9.1f}{r['error_rate'] * 100:>8.2f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+
+
+def start_local_server(stub_cost_ms: float, workdir: Path) -> Tuple[str, object]:
+    """Levanta la app en un hilo con SQLite y el motor determinista"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'loadtest.db'}"
+    import uvicorn
+    from app import app, router
+    from app.engines import StubEngine, set_engine
+
+    upload_dir = workdir / "uploads"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    def save_image(image_bytes: bytes, user_id) -> str:
+        filepath = upload_dir / f"{user_id}.bin"
+        filepath.write_bytes(image_bytes)
+        return str(filepath)
+
+    # Las imágenes sintéticas no son JPEG válidos
+    set_engine(StubEngine(cost_ms=stub_cost_ms))
+    router.save_image = save_image
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("El servidor local no pudo iniciar")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def image_dir_source(image_dir: Path):
+    """Asigna a cada usuario una carpeta de fotos reales (una subcarpeta por persona)"""
+    people = sorted(p for p in image_dir.iterdir() if p.is_dir())
+    if not people:
+        raise SystemExit(f"{image_dir} no contiene subcarpetas por persona")
+    assigned = {}
+
+    def source(user_id: str, shot: int) -> bytes:
+        person = assigned.setdefault(user_id, people[len(assigned) % len(people)])
+        photos = sorted(person.glob("*.jpg")) or sorted(person.iterdir())
+        return photos[(shot - 1) % len(photos)].read_bytes()
+
+    return source
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la API de control de acceso facial")
+    parser.add_argument("--url", help="Servidor ya desplegado (por defecto: app en proceso con SQLite y motor stub)")
+    parser.add_argument("--image-dir", type=Path, help="Fotos reales, una subcarpeta por persona (requerido con --url)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("register=1,verify=4,check-lab-access=4,logs=1"))
+    parser.add_argument("--users", type=int, default=50, help="Usuarios con rostro registrado antes de medir")
+    parser.add_argument("--labs", type=int, default=4)
+    parser.add_argument("--permission-ratio", type=float, default=0.5)
+    parser.add_argument("--stub-cost-ms", type=float, default=20.0, help="Costo de CPU simulado por encoding")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Guardar el reporte en JSON")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    share = args.mix.get("register", 0) / sum(args.mix.values())
+    register_pool = int(args.requests * share * 1.2) + 1 if share else 0
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        if args.url:
+            if not args.image_dir:
+                parser.error("--image-dir es requerido con --url")
+            base_url, server = args.url, None
+            image_source = image_dir_source(args.image_dir)
+        else:
+            base_url, server = start_local_server(args.stub_cost_ms, Path(tmp))
+            image_source = make_stub_image
+
+        try:
+            scenario = Scenario(Client(base_url), image_source)
+            print(f"Preparando escenario en {base_url} ...", file=sys.stderr)
+            scenario.setup(args.labs, args.users, register_pool, args.permission_ratio)
+            report, wall = run_load(scenario, args.mix, args.requests, args.concurrency)
+        finally:
+            if server is not None:
+                server.should_exit = True
+
+    print_report(report, wall, args.requests)
+    if args.json:
+        args.json.write_text(json.dumps({"wall_s": wall, "endpoints": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
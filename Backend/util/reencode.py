@@ -0,0 +1,145 @@
+"""Recalcula los embeddings guardados a partir de las imágenes en ``image_path``.
+
+Uso (desde Backend/, con la misma DATABASE_URL que la API):
+
+    python -m util.reencode --engine dlib-hog --jitters 10 --workers 2 --max-rate 20
+
+Recorre los embeddings cuya ``engine_version`` difiere de la del motor elegido
+en bloques ordenados por id, los recalcula en un pool de procesos y los escribe
+con un UPDATE por bloque. Tras cada bloque guarda el último id procesado en el
+archivo de checkpoint, de modo que al relanzar el comando continúa donde quedó.
+
+Para no quitarle CPU al tráfico de verificación los workers corren con menor
+prioridad (--nice), el pool es pequeño por defecto y --max-rate limita las
+imágenes por segundo.
+
+Cada bloque actualiza ``updated_at`` en su propia transacción, con la hora de
+la escritura, así las galerías en memoria de la API aplican los nuevos encodings
+en la siguiente comprobación (ver GalleryRegistry) y los kioscos los reciben en
+su próximo delta. Mientras el recorrido no termina la galería mezcla encodings
+viejos y nuevos: con el mismo motor (p. ej. otro --jitters) siguen siendo
+comparables; si cambia la dimensión o la métrica, los aún no recalculados quedan
+fuera de la galería, por lo que conviene cambiar FACE_ENGINE en la API solo al
+terminar.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+from uuid import UUID
+
+from app import crud
+from app.database import SessionLocal
+from app.engines import FACE_ENGINE, FACE_NUM_JITTERS, FaceEngine, build_engine
+
+_worker_engine: Optional[FaceEngine] = None
+
+
+def _init_worker(engine_name: str, num_jitters: int, nice: int):
+    global _worker_engine
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    _worker_engine = build_engine(engine_name, num_jitters=num_jitters)
+
+
+def _encode(task: Tuple[UUID, str]) -> Tuple[UUID, Optional[list], Optional[str]]:
+    embedding_id, image_path = task
+    try:
+        encoding = _worker_engine.extract(Path(image_path).read_bytes())
+        return embedding_id, encoding.tolist(), None
+    except Exception as e:
+        return embedding_id, None, str(e)
+
+
+def load_checkpoint(path: Path, engine_version: str) -> dict:
+    if path.exists():
+        checkpoint = json.loads(path.read_text())
+        if checkpoint.get("engine_version") == engine_version:
+            return checkpoint
+    return {"engine_version": engine_version, "last_id": None, "updated": 0, "failed": 0}
+
+
+def save_checkpoint(path: Path, checkpoint: dict):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(checkpoint, indent=2))
+    tmp.replace(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-codificación de embeddings faciales")
+    parser.add_argument("--engine", default=FACE_ENGINE)
+    parser.add_argument("--jitters", type=int, default=FACE_NUM_JITTERS)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument("--chunk", type=int, default=64, help="Embeddings por bloque (y por UPDATE)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Imágenes por segundo como máximo (0 = sin límite)")
+    parser.add_argument("--nice", type=int, default=10, help="Incremento de niceness de los workers")
+    parser.add_argument("--checkpoint", type=Path, default=Path("reencode.checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint existente")
+    args = parser.parse_args(argv)
+
+    engine = build_engine(args.engine, num_jitters=args.jitters)
+    checkpoint = load_checkpoint(args.checkpoint, engine.version)
+    if args.restart:
+        checkpoint.update(last_id=None, updated=0, failed=0)
+    last_id = UUID(checkpoint["last_id"]) if checkpoint["last_id"] else None
+    print(f"Motor {engine.version}; continuando después de {last_id}" if last_id else f"Motor {engine.version}")
+
+    db = SessionLocal()
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.engine, args.jitters, args.nice),
+    )
+    try:
+        while True:
+            rows = crud.get_stale_facial_embeddings(db, engine.version, last_id, args.chunk)
+            # Cerrar la transacción de lectura antes de codificar: el UPDATE abre
+            # una nueva y updated_at queda con la hora de la escritura
+            db.commit()
+            if not rows:
+                break
+
+            started = time.monotonic()
+            tasks = [(embedding_id, image_path) for embedding_id, _, image_path in rows]
+            updates = []
+            for embedding_id, encoding, error in pool.map(_encode, tasks):
+                if error is not None:
+                    checkpoint["failed"] += 1
+                    print(f"  {embedding_id}: {error}")
+                    continue
+                updates.append({
+                    "id": embedding_id,
+                    "embedding": encoding,
+                    "engine": engine.name,
+                    "engine_version": engine.version,
+                    "embedding_dim": len(encoding),
+                    "metric": engine.metric,
+                })
+            crud.bulk_update_facial_embeddings(db, updates)
+
+            last_id = rows[-1][0]
+            checkpoint["last_id"] = str(last_id)
+            checkpoint["updated"] += len(updates)
+            save_checkpoint(args.checkpoint, checkpoint)
+            print(f"Actualizados {checkpoint['updated']}, fallidos {checkpoint['failed']}")
+
+            if args.max_rate > 0:
+                remaining = len(rows) / args.max_rate - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+    finally:
+        pool.shutdown()
+        db.close()
+
+    # Recorrido completo: la próxima ejecución vuelve a empezar con contadores
+    # nuevos (y reintenta los fallidos)
+    print(f"Terminado: {checkpoint['updated']} actualizados, {checkpoint['failed']} fallidos")
+    checkpoint.update(last_id=None, updated=0, failed=0)
+    save_checkpoint(args.checkpoint, checkpoint)
+
+
+if __name__ == "__main__":
+    main()